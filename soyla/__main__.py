@@ -1,20 +1,84 @@
 # encoding: utf-8
 import argparse
+import os
+import sys
 from pathlib import Path
 
+from .audio import AudioReadWriter
 from .soyla import Soyla
+from .stats import SessionStats
 
 
-def main(input_file, save_dir, samplerate=44100):
-    s = Soyla(input_file, save_dir, samplerate=samplerate)
+def non_negative(s):
+    v = int(s)
+    if v < 0:
+        raise argparse.ArgumentTypeError("must be non-negative: {}".format(s))
+    return v
+
+
+def positive(s):
+    v = int(s)
+    if v < 1:
+        raise argparse.ArgumentTypeError("must be positive: {}".format(s))
+    return v
+
+
+def main(input_file, save_dir, samplerate=44100, preroll=0, postroll=0):
+    s = Soyla(input_file, save_dir, samplerate=samplerate, preroll=preroll, postroll=postroll)
     s.run()
 
 
+def normalize_rate(save_dir, samplerate=44100, workers=None):
+    audiorw = AudioReadWriter(save_dir, samplerate)
+    failed = False
+    for i, e in audiorw.normalize_rate(workers=workers):
+        if e is None:
+            print("{}.wav resampled to {}".format(i, samplerate), flush=True)
+        else:
+            failed = True
+            print("{}.wav failed: {}".format(i, e), file=sys.stderr, flush=True)
+    if failed:
+        sys.exit(1)
+
+
+def print_stats(input_file, save_dir):
+    # only check wav files exist, reading all of them is slow on large projects
+    with open(input_file, 'r') as f:
+        lines_len = len(f.readlines())
+    remaining = sum(1 for i in range(lines_len)
+                    if not os.path.exists(os.path.join(save_dir, '{}.wav'.format(i))))
+    st = SessionStats(os.path.join(save_dir, 'events.log'))
+    st.update()
+    s = st.summary(remaining=remaining)
+    print("Session time: {:.1f} hours ({:.1f} idle)".format(s['wall_time'] / 3600, s['idle_time'] / 3600))
+    print("Recorded lines: {} of {}, remaining: {}".format(lines_len - remaining, lines_len, remaining))
+    print("Lines recorded since logging began: {}".format(s['recorded_lines']))
+    print("Takes per line: {:.2f}".format(s['takes_per_line']))
+    print("Re-record rate: {:.1%}".format(s['re_record_rate']))
+    print("Cancelled takes: {}".format(s['cancels']))
+    print("Recorded audio per hour: {:.1f} minutes".format(s['audio_per_hour'] / 60))
+    if s['projected_time'] is not None:
+        print("Projected time to finish: {:.1f} hours".format(s['projected_time'] / 3600))
+
+
 parser = argparse.ArgumentParser("soyla")
 parser.add_argument('lines', type=Path, help='path to file with lines')
 parser.add_argument('wav_dir', type=Path, help='path to directory containing wav files')
 parser.add_argument('-sr', '--samplerate', type=int, default=44100, help='audio samplerate, default: 44100')
+parser.add_argument('--normalize-rate', action='store_true',
+                    help='resample wav files with different samplerate and exit (rewrites files in place)')
+parser.add_argument('-j', '--jobs', type=positive, default=None, help='number of parallel jobs for --normalize-rate')
+parser.add_argument('--preroll', type=non_negative, default=0,
+                    help='milliseconds of audio kept before recording start, default: 0')
+parser.add_argument('--postroll', type=non_negative, default=0,
+                    help='milliseconds of audio captured after recording stop, default: 0')
+parser.add_argument('--stats', action='store_true', help='print recording session statistics and exit')
 
 if __name__ == '__main__':
     args = parser.parse_args()
-    main(args.lines, args.wav_dir, args.samplerate)
+    if args.stats:
+        print_stats(args.lines, args.wav_dir)
+    elif args.normalize_rate:
+        normalize_rate(args.wav_dir, args.samplerate, args.jobs)
+    else:
+        main(args.lines, args.wav_dir, args.samplerate, args.preroll, args.postroll)
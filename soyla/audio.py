@@ -2,8 +2,49 @@
 import numpy as np
 import glob
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from math import gcd
+
 import sounddevice as sd
 from scipy.io import wavfile
+from scipy.signal import firwin, resample_poly
+
+
+@lru_cache(maxsize=None)
+def _resample_filter(up, down):
+    """
+    designs (and caches) low-pass filter for polyphase resampling,
+    same design resample_poly uses by default
+    :param up: upsampling factor
+    :param down: downsampling factor
+    :returns: numpy array of filter coefficients
+    """
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    h = firwin(2 * half_len + 1, 1. / max_rate, window=('kaiser', 5.0))
+    h.flags.writeable = False
+    return h
+
+
+def resample(data, from_rate, to_rate):
+    """
+    resamples audio using polyphase filtering
+    :param data: numpy array of audio
+    :param from_rate: samplerate of data
+    :param to_rate: target samplerate
+    :returns: numpy array of resampled audio with the same dtype
+    """
+    if from_rate == to_rate:
+        return data
+    g = gcd(from_rate, to_rate)
+    up, down = to_rate // g, from_rate // g
+    res = resample_poly(data, up, down, window=_resample_filter(up, down))
+    if np.issubdtype(data.dtype, np.integer):
+        info = np.iinfo(data.dtype)
+        res = np.clip(np.round(res), info.min, info.max)
+    return res.astype(data.dtype)
 
 
 class AudioReadWriter(object):
@@ -36,14 +77,16 @@ class AudioReadWriter(object):
         """
         wavs = glob.glob(os.path.join(self.wav_dir, '*.wav'))
         self._lengths = {}
+        self._rates = {}
         for w in wavs:
             i = os.path.splitext(os.path.basename(w))[0]
             try:
                 i = int(i)
             except ValueError:
                 continue
-            _, s = wavfile.read(w)
-            self._lengths[i] = s.shape[0] / self.samplerate
+            sr, s = wavfile.read(w)
+            self._rates[i] = sr
+            self._lengths[i] = s.shape[0] / sr
         self._calc_sum_len()
 
     def data(self, i):
@@ -57,6 +100,13 @@ class AudioReadWriter(object):
         _, s = wavfile.read(os.path.join(self.wav_dir, "{}.wav".format(i)))
         return s
 
+    def rate(self, i):
+        """
+        :param i: index of audio file
+        :returns: samplerate of audio file
+        """
+        return self._rates.get(i)
+
     def length(self, i):
         """
         :param i: index of audio file
@@ -66,15 +116,42 @@ class AudioReadWriter(object):
 
     def save(self, i, data):
         """
-        saves audio as wav file and recalculates its length
+        saves audio as wav file and recalculates its length,
+        file is written to temporary path first and then moved in place
+        so interrupted write never leaves truncated wav
         :param i: index of audio file
         :param data: numpy array of audio
         """
-        wavfile.write(os.path.join(self.wav_dir, '{}.wav'.format(i)),
-                      self.samplerate, data)
+        path = os.path.join(self.wav_dir, '{}.wav'.format(i))
+        wavfile.write(path + '.tmp', self.samplerate, data)
+        os.replace(path + '.tmp', path)
+        self._rates[i] = self.samplerate
         self._lengths[i] = data.shape[0] / self.samplerate
         self._calc_sum_len()
 
+    def mismatched(self):
+        """
+        :returns: indices of audio files whose samplerate differs from
+        the project samplerate
+        """
+        return sorted(i for i, sr in self._rates.items() if sr != self.samplerate)
+
+    def normalize_rate(self, workers=None):
+        """
+        resamples audio files with mismatched samplerate to the project
+        samplerate and rewrites them
+        :param workers: optional number of worker threads
+        :returns: generator of (index, exception or None) pairs,
+        yielded as each file finishes
+        """
+        def normalize(i):
+            self.save(i, resample(self.data(i), self._rates[i], self.samplerate))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(normalize, i): i for i in self.mismatched()}
+            for f in as_completed(futures):
+                yield futures[f], f.exception()
+
     def __setitem__(self, key, value):
         if type(key) != int:
             raise TypeError("key must be int")
@@ -88,17 +165,36 @@ class AudioDevice(object):
     """
     Class handles recording and playing audio
     """
-    def __init__(self, samplerate):
+    def __init__(self, samplerate, preroll=0, postroll=0, input_stream=sd.InputStream):
         """
         :param samplerate: audio samplerate
+        :param preroll: milliseconds of audio captured before recording start
+        :param postroll: milliseconds of audio captured after recording stop
+        :param input_stream: factory of input streams, sd.InputStream by default
         """
+        if preroll < 0 or postroll < 0:
+            raise ValueError("preroll and postroll must be non-negative")
         self.samplerate = samplerate
+        self._input_stream = input_stream
+        self._lock = threading.Lock()
+        self._recording = False
+        self._postroll_left = None
+        self._finish_cb = None
+        self._in_stream = None
+        self._postroll_frames = int(samplerate * postroll / 1000)
+        self._ring = np.zeros(int(samplerate * preroll / 1000), dtype='float32')
+        self._ring_pos = 0
+        self._ring_filled = 0
+        if self._ring.size > 0:
+            # keep input stream always open to fill preroll buffer
+            self._in_stream = self._open_input()
 
-    def play(self, data, cb=None):
+    def play(self, data, cb=None, samplerate=None):
         """
         plays specified audio
         :param data: numpy array of audio data
         :param cb: optional callback when the playback stops
+        :param samplerate: samplerate of data, resampled to device samplerate if differs
         """
         def callback(outdata, frames, time, status):
             if self._play_frames + frames > self._play_buf.size:
@@ -106,7 +202,10 @@ class AudioDevice(object):
             outdata[:, 0] = self._play_buf[self._play_frames:self._play_frames + frames]
             self._play_frames += frames
 
-        self._play_buf = np.copy(data)
+        if samplerate is None or samplerate == self.samplerate:
+            self._play_buf = np.copy(data)
+        else:
+            self._play_buf = resample(data, samplerate, self.samplerate)
         self._play_frames = 0
         self._out_stream = sd.OutputStream(channels=1, samplerate=self.samplerate,
                                            callback=callback, finished_callback=cb)
@@ -118,22 +217,122 @@ class AudioDevice(object):
         """
         self._out_stream.stop()
 
-    def start_recording(self):
+    def _open_input(self):
         """
-        start audio recording
+        opens and starts input stream
+        :returns: input stream object
         """
-        self._indata = []
+        stream = self._input_stream(channels=1, samplerate=self.samplerate,
+                                    callback=self._input_callback)
+        stream.start()
+        return stream
 
-        def callback(indata, frames, time, status):
+    def _close_input(self):
+        """
+        stops and closes input stream if opened
+        """
+        if self._in_stream is not None:
+            self._in_stream.stop()
+            self._in_stream.close()
+            self._in_stream = None
+
+    def _input_callback(self, indata, frames, time, status):
+        """
+        input stream callback, fills preroll buffer and recorded data,
+        finishes recording once postroll is captured
+        """
+        with self._lock:
+            self._push_ring(indata[:, 0])
+            if not self._recording:
+                return
             self._indata.append(np.copy(indata[:, 0]))
-        self._in_stream = sd.InputStream(channels=1, samplerate=self.samplerate, callback=callback)
-        self._in_stream.start()
+            if self._postroll_left is None:
+                return
+            self._postroll_left -= frames
+            if self._postroll_left > 0:
+                return
+            self._recording = False
+            data = np.concatenate(self._indata)
+            cb = self._finish_cb
+        cb(data)
+        if self._ring.size == 0:
+            # stream is closed when next recording starts
+            raise sd.CallbackStop()
+
+    def _push_ring(self, block):
+        """
+        writes block of audio into circular preroll buffer
+        :param block: numpy array of audio
+        """
+        n = self._ring.size
+        if n == 0:
+            return
+        if block.size >= n:
+            self._ring[:] = block[-n:]
+            self._ring_pos = 0
+        else:
+            end = self._ring_pos + block.size
+            if end <= n:
+                self._ring[self._ring_pos:end] = block
+            else:
+                k = n - self._ring_pos
+                self._ring[self._ring_pos:] = block[:k]
+                self._ring[:end - n] = block[k:]
+            self._ring_pos = end % n
+        self._ring_filled = min(n, self._ring_filled + block.size)
+
+    def _ring_data(self):
+        """
+        :returns: numpy array of audio in preroll buffer, oldest first
+        """
+        if self._ring_filled < self._ring.size:
+            return self._ring[:self._ring_filled].copy()
+        return np.concatenate((self._ring[self._ring_pos:], self._ring[:self._ring_pos]))
+
+    def start_recording(self):
+        """
+        start audio recording, prepending preroll buffer contents
+        """
+        if self._ring.size == 0:
+            self._close_input()
+        with self._lock:
+            self._indata = [self._ring_data()]
+            self._postroll_left = None
+            self._finish_cb = None
+            self._recording = True
+        if self._ring.size == 0:
+            self._in_stream = self._open_input()
+
+    def stop_recording(self, cb):
+        """
+        stop audio recording after capturing postroll audio,
+        does not block while postroll is captured
+        :param cb: callback called with numpy array of recorded audio,
+        from the input stream thread if postroll is set
+        """
+        with self._lock:
+            if self._postroll_frames > 0:
+                self._postroll_left = self._postroll_frames
+                self._finish_cb = cb
+                return
+            self._recording = False
+            data = np.concatenate(self._indata)
+        if self._ring.size == 0:
+            self._close_input()
+        cb(data)
+
+    def cancel_recording(self):
+        """
+        stop audio recording immediately, discarding recorded audio
+        """
+        with self._lock:
+            self._recording = False
+            self._finish_cb = None
+        if self._ring.size == 0:
+            self._close_input()
 
-    def stop_recording(self):
+    def close(self):
         """
-        stop audio recording
-        :returns: numpy array of recorded audio
+        close input stream if opened
         """
-        self._in_stream.stop()
-        self._in_stream.close()
-        return np.concatenate(self._indata)
+        self._close_input()
@@ -81,6 +81,12 @@ class SoylaModel(object):
         """
         return self.audiorw.data(self._l_index)
 
+    def cur_audio_rate(self):
+        """
+        :returns: samplerate of audio of currently selected line
+        """
+        return self.audiorw.rate(self._l_index)
+
     def save_audio(self, i, data):
         """
         saves audio to wav file
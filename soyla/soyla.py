@@ -1,27 +1,40 @@
 # encoding: utf-8
+import os
+from functools import partial
+
 import urwid
 
 from .audio import AudioReadWriter, AudioDevice
 from .model import SoylaModel
 from .view import SoylaView
 from .state import SoylaState
+from . import stats
 
 
 class Soyla(object):
     """
     Controller class for the program
     """
-    def __init__(self, lines_file, save_dir, samplerate=44100):
+    def __init__(self, lines_file, save_dir, samplerate=44100, preroll=0, postroll=0):
         """
         :param lines_file: path to file containing lines
         :param save_dir: path to directory containing recorded wav files
+        :param samplerate: audio samplerate
+        :param preroll: milliseconds of audio kept before recording start
+        :param postroll: milliseconds of audio captured after recording stop
         """
         self.save_dir = save_dir
         self.lines_file = lines_file
 
-        self.audio = AudioDevice(samplerate)
+        self.audio = AudioDevice(samplerate, preroll=preroll, postroll=postroll)
         self.model = SoylaModel(self.lines_file, AudioReadWriter(self.save_dir, samplerate))
         self.view = SoylaView(self.model)
+        self.events = stats.EventLog(os.path.join(self.save_dir, 'events.log'))
+        self.events.log(stats.SESSION)
+        self._finishing = False
+        # sequence number of current take and (take, data) of last finished one
+        self._take = 0
+        self._recorded = (0, None)
 
         self.set_state(SoylaState.WAITING)
 
@@ -78,20 +91,50 @@ class Soyla(object):
         cancel recording audio
         """
         assert self.state == SoylaState.RECORDING
-        self.audio.stop_recording()
+        self._finishing = False
+        self.audio.cancel_recording()
+        self.events.log(stats.RECORD_CANCEL, self.model.l_index)
+        self.events.flush()
         self.set_state(SoylaState.WAITING)
 
     def finish_record(self):
         """
-        finish recording, save recorded audio
+        finish recording, recorded audio is saved once postroll is captured
         """
         assert self.state == SoylaState.RECORDING
-        data = self.audio.stop_recording()
+        if self._finishing:
+            return
+        self._finishing = True
+        self.audio.stop_recording(partial(self._record_finished, self._take))
+
+    def _record_finished(self, take, data):
+        """
+        called by audio device when recording is finished, possibly
+        from input stream thread, hands recorded audio over to main loop
+        :param take: sequence number of finished take
+        :param data: numpy array of recorded audio
+        """
+        self._recorded = (take, data)
+        os.write(self._record_pipe, b'.')
+
+    def _save_record(self, _):
+        """
+        main loop pipe callback, saves recorded audio
+        """
+        take, data = self._recorded
+        if not self._finishing or take != self._take:
+            # recording was cancelled during postroll,
+            # or wakeup is left over from cancelled take
+            return True
+        self._finishing = False
         self.model.save_audio(self.model.l_index, data)
+        self.events.log(stats.RECORD_FINISH, self.model.l_index, self.model.cur_audio_length())
+        self.events.flush()
         self.view.update_sidebar_line(self.model.l_index)
         self.set_state(SoylaState.WAITING)
         self.view.update_line()
         self.view.show_saved()
+        return True
 
     def record(self):
         """
@@ -99,7 +142,9 @@ class Soyla(object):
         """
         assert self.state == SoylaState.WAITING
         self.set_state(SoylaState.RECORDING)
+        self._take += 1
         self.audio.start_recording()
+        self.events.log(stats.RECORD_START, self.model.l_index)
 
     def cancel_play(self):
         """
@@ -116,11 +161,13 @@ class Soyla(object):
         if self.model.cur_audio() is None:
             return
         self.set_state(SoylaState.PLAYING)
+        self.events.log(stats.PLAY, self.model.l_index, self.model.cur_audio_length())
 
         def fcallback():
             self.set_state(SoylaState.WAITING)
             self.force_draw()
-        self.audio.play(self.model.cur_audio(), cb=fcallback)
+        self.audio.play(self.model.cur_audio(), cb=fcallback,
+                        samplerate=self.model.cur_audio_rate())
 
     def change_line(self, d):
         """
@@ -128,6 +175,7 @@ class Soyla(object):
         """
         assert self.state == SoylaState.WAITING
         self.model.change_line(d)
+        self.events.log(stats.NAVIGATE, self.model.l_index)
         self.view.update_line()
 
     def edit(self):
@@ -155,6 +203,7 @@ class Soyla(object):
         self.model.update_line(self.model.l_index, edit_txt)
         self.view.update_sidebar_line(self.model.l_index)
         self.update_lines_file()
+        self.events.log(stats.EDIT, self.model.l_index)
         self.set_state(SoylaState.WAITING)
         self.view.update_line()
         self.view.show_saved()
@@ -174,4 +223,10 @@ class Soyla(object):
             unhandled_input=lambda k: self.handle_input(k),
             palette=self.view.PALETTE,
         )
-        self.loop.run()
+        self._record_pipe = self.loop.watch_pipe(self._save_record)
+        try:
+            self.loop.run()
+        finally:
+            self.loop.remove_watch_pipe(self._record_pipe)
+            self.audio.close()
+            self.events.close()
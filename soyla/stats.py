@@ -0,0 +1,216 @@
+# encoding: utf-8
+import json
+import os
+import time
+
+
+SESSION = 'session'
+RECORD_START = 'record_start'
+RECORD_FINISH = 'record_finish'
+RECORD_CANCEL = 'record_cancel'
+EDIT = 'edit'
+NAVIGATE = 'navigate'
+PLAY = 'play'
+
+CACHE_VERSION = 2
+_CACHE_KEYS = ('offset', 'last_ts', 'take_open', 'play_len', 'active_time', 'idle_time',
+               'takes', 'lengths', 'retakes', 'cancels', 'edits', 'navigations')
+
+
+class EventLog(object):
+    """
+    Class handles appending timestamped events to log file.
+    Each event is a tab separated line: timestamp, event, line index, value
+    """
+    def __init__(self, path, clock=time.time):
+        """
+        :param path: path to event log file
+        :param clock: function returning current time in seconds
+        """
+        self.path = path
+        self.clock = clock
+        self._f = open(path, 'a', buffering=64 * 1024)
+        if self._f.tell() > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    # previous session was killed mid-write
+                    self._f.write('\n')
+
+    def log(self, event, i=-1, value=0.):
+        """
+        appends event to the log buffer
+        :param event: event name
+        :param i: index of line the event relates to
+        :param value: event value, for example length of recorded audio
+        """
+        self._f.write("{:.3f}\t{}\t{}\t{:.3f}\n".format(self.clock(), event, i, value))
+
+    def flush(self):
+        """
+        write buffered events to disk
+        """
+        self._f.flush()
+
+    def close(self):
+        """
+        flush and close log file
+        """
+        self._f.close()
+
+
+class SessionStats(object):
+    """
+    Class aggregates event log into session statistics. Aggregates are
+    cached next to the log together with the processed log offset,
+    so only new events are read on each update.
+    """
+    def __init__(self, log_path, idle_threshold=60.):
+        """
+        :param log_path: path to event log file
+        :param idle_threshold: gap between events in seconds
+        after which the time is counted as idle, time while recording
+        or playing back audio is never idle
+        """
+        self.log_path = log_path
+        self.cache_path = log_path + '.stats'
+        self.idle_threshold = idle_threshold
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        """
+        resets aggregates to the empty state
+        """
+        self.offset = 0
+        self.last_ts = None
+        self.take_open = False
+        self.play_len = 0.
+        self.active_time = 0.
+        self.idle_time = 0.
+        self.takes = {}
+        self.lengths = {}
+        self.retakes = 0
+        self.cancels = 0
+        self.edits = 0
+        self.navigations = 0
+
+    def _load(self):
+        """
+        loads cached aggregates if present and valid,
+        otherwise aggregates are rebuilt from the start of the log
+        """
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r') as f:
+                c = json.load(f)
+            if c['version'] != CACHE_VERSION or c['idle_threshold'] != self.idle_threshold:
+                return
+            for k in _CACHE_KEYS:
+                setattr(self, k, c[k])
+            self.takes = {int(k): v for k, v in c['takes'].items()}
+            self.lengths = {int(k): v for k, v in c['lengths'].items()}
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self._reset()
+
+    def _save(self):
+        """
+        writes aggregates to cache file, through temporary file
+        so interrupted write never leaves partial cache
+        """
+        c = {k: getattr(self, k) for k in _CACHE_KEYS}
+        c['version'] = CACHE_VERSION
+        c['idle_threshold'] = self.idle_threshold
+        with open(self.cache_path + '.tmp', 'w') as f:
+            json.dump(c, f)
+        os.replace(self.cache_path + '.tmp', self.cache_path)
+
+    def _add(self, ts, event, i, value):
+        """
+        adds single event to aggregates
+        """
+        if event == SESSION:
+            # time between sessions is not counted
+            self.last_ts = ts
+            self.take_open = False
+            self.play_len = 0.
+            return
+        if self.last_ts is not None:
+            gap = ts - self.last_ts
+            if self.take_open:
+                # time while recording is never idle
+                self.active_time += gap
+            else:
+                # neither is time while previous event's playback lasted
+                busy = min(gap, self.play_len)
+                rest = gap - busy
+                self.active_time += busy
+                if rest > self.idle_threshold:
+                    self.idle_time += rest
+                else:
+                    self.active_time += rest
+        self.last_ts = ts
+        self.take_open = event == RECORD_START
+        self.play_len = value if event == PLAY else 0.
+        if event == RECORD_FINISH:
+            if i in self.lengths:
+                self.retakes += 1
+            self.takes[i] = self.takes.get(i, 0) + 1
+            self.lengths[i] = value
+        elif event == RECORD_CANCEL:
+            self.cancels += 1
+        elif event == EDIT:
+            self.edits += 1
+        elif event == NAVIGATE:
+            self.navigations += 1
+
+    def update(self):
+        """
+        reads events appended since last update
+        """
+        if not os.path.exists(self.log_path):
+            return
+        if os.path.getsize(self.log_path) < self.offset:
+            # log was truncated, start over
+            self._reset()
+        with open(self.log_path, 'rb') as f:
+            f.seek(self.offset)
+            for l in f:
+                if not l.endswith(b'\n'):
+                    # incomplete line, will be read next time
+                    break
+                self.offset += len(l)
+                try:
+                    ts, event, i, value = l.decode().rstrip('\n').split('\t')
+                    ts, i, value = float(ts), int(i), float(value)
+                except ValueError:
+                    # malformed line, for example from killed session
+                    continue
+                self._add(ts, event, i, value)
+        self._save()
+
+    def summary(self, remaining=0):
+        """
+        :param remaining: number of lines without recorded audio
+        :returns: dict with session statistics, line counts and projected
+        time cover only the lines recorded since logging began
+        """
+        wall = self.active_time + self.idle_time
+        n_takes = sum(self.takes.values())
+        audio = sum(self.lengths.values())
+        n_lines = len(self.lengths)
+        return {
+            'wall_time': wall,
+            'active_time': self.active_time,
+            'idle_time': self.idle_time,
+            'recorded_lines': n_lines,
+            'takes': n_takes,
+            'takes_per_line': n_takes / n_lines if n_lines else 0.,
+            're_record_rate': self.retakes / n_takes if n_takes else 0.,
+            'cancels': self.cancels,
+            'edits': self.edits,
+            'navigations': self.navigations,
+            'audio_per_hour': audio / wall * 3600 if wall else 0.,
+            'projected_time': wall / n_lines * remaining if n_lines else None,
+        }
@@ -0,0 +1,257 @@
+# encoding: utf-8
+import os
+
+import numpy as np
+import pytest
+import sounddevice as sd
+from scipy.io import wavfile
+
+from soyla.audio import AudioDevice, AudioReadWriter, resample
+
+
+SAMPLERATE = 1000  # one frame per millisecond
+
+
+class FakeInputStream(object):
+    """
+    Input stream that delivers frames only when fed by the test
+    """
+    instances = []
+
+    def __init__(self, channels, samplerate, callback):
+        self.callback = callback
+        self.started = False
+        self.closed = False
+        FakeInputStream.instances.append(self)
+
+    def start(self):
+        self.started = True
+
+    def stop(self):
+        self.started = False
+
+    def close(self):
+        self.closed = True
+
+    def feed(self, block):
+        """
+        delivers block of audio to the stream callback
+        :param block: 1d array-like of audio
+        """
+        indata = np.asarray(block, dtype='float32')[:, None]
+        try:
+            self.callback(indata, indata.shape[0], None, None)
+        except sd.CallbackStop:
+            self.started = False
+
+
+@pytest.fixture(autouse=True)
+def clear_streams():
+    FakeInputStream.instances = []
+
+
+def device(preroll=0, postroll=0):
+    return AudioDevice(SAMPLERATE, preroll=preroll, postroll=postroll,
+                       input_stream=FakeInputStream)
+
+
+def stream():
+    return FakeInputStream.instances[-1]
+
+
+class Counter(object):
+    """
+    Produces consecutive sample values so the order of audio is checkable
+    """
+    def __init__(self):
+        self.n = 0
+
+    def __call__(self, frames):
+        block = np.arange(self.n, self.n + frames)
+        self.n += frames
+        return block
+
+
+def preroll(d):
+    """
+    :returns: audio recorded by a take started and stopped right away
+    """
+    result = []
+    d.start_recording()
+    d.stop_recording(result.append)
+    return result[0]
+
+
+def test_ring_partially_filled():
+    d = device(preroll=10)
+    stream().feed(np.arange(4))
+    np.testing.assert_array_equal(preroll(d), np.arange(4))
+
+
+def test_ring_wraps():
+    d = device(preroll=10)
+    c = Counter()
+    for _ in range(7):
+        stream().feed(c(3))
+    np.testing.assert_array_equal(preroll(d), np.arange(11, 21))
+
+
+def test_ring_block_larger_than_ring():
+    d = device(preroll=10)
+    stream().feed(np.arange(3))
+    stream().feed(np.arange(100, 125))
+    np.testing.assert_array_equal(preroll(d), np.arange(115, 125))
+    stream().feed([7])
+    np.testing.assert_array_equal(preroll(d), np.r_[np.arange(116, 125), 7])
+
+
+def test_ring_block_equal_to_ring():
+    d = device(preroll=10)
+    stream().feed(np.arange(10))
+    np.testing.assert_array_equal(preroll(d), np.arange(10))
+
+
+def test_preroll_prepended_in_order():
+    d = device(preroll=10)
+    c = Counter()
+    stream().feed(c(12))
+    d.start_recording()
+    stream().feed(c(3))
+    result = []
+    d.stop_recording(result.append)
+    np.testing.assert_array_equal(result[0], np.arange(2, 15))
+    # always-on stream stays open
+    assert len(FakeInputStream.instances) == 1
+    assert stream().started
+
+
+def test_postroll_stops_after_n_frames():
+    d = device(preroll=5, postroll=6)
+    c = Counter()
+    stream().feed(c(5))
+    d.start_recording()
+    stream().feed(c(4))
+    result = []
+    d.stop_recording(result.append)
+    assert result == []
+    stream().feed(c(4))
+    assert result == []
+    stream().feed(c(4))
+    assert len(result) == 1
+    np.testing.assert_array_equal(result[0], np.arange(17))
+    stream().feed(c(4))
+    assert len(result) == 1
+    assert stream().started
+
+
+def test_cancel_skips_postroll():
+    d = device(postroll=6)
+    c = Counter()
+    d.start_recording()
+    stream().feed(c(4))
+    result = []
+    d.stop_recording(result.append)
+    d.cancel_recording()
+    assert stream().closed
+    stream().feed(c(10))
+    assert result == []
+
+
+def test_cancel_without_postroll():
+    d = device(postroll=6)
+    d.start_recording()
+    stream().feed(np.arange(4))
+    d.cancel_recording()
+    assert stream().closed
+
+
+def test_no_preroll_opens_stream_per_take():
+    d = device()
+    assert FakeInputStream.instances == []
+    result = []
+    for take in range(2):
+        d.start_recording()
+        assert len(FakeInputStream.instances) == take + 1
+        assert stream().started
+        stream().feed(np.arange(3) + take)
+        d.stop_recording(result.append)
+        assert stream().closed
+    np.testing.assert_array_equal(result[0], np.arange(3))
+    np.testing.assert_array_equal(result[1], np.arange(1, 4))
+
+
+def test_no_preroll_postroll_closes_stream():
+    d = device(postroll=2)
+    d.start_recording()
+    first = stream()
+    first.feed(np.arange(3))
+    result = []
+    d.stop_recording(result.append)
+    first.feed(np.arange(3, 5))
+    np.testing.assert_array_equal(result[0], np.arange(5))
+    assert not first.started
+    d.start_recording()
+    assert first.closed
+    d.close()
+    assert stream().closed
+
+
+def test_negative_lengths_rejected():
+    with pytest.raises(ValueError):
+        device(preroll=-1)
+    with pytest.raises(ValueError):
+        device(postroll=-1)
+
+
+def write_wav(d, name, rate, seconds):
+    data = np.zeros(int(rate * seconds), dtype='int16')
+    wavfile.write(os.path.join(str(d), name), rate, data)
+
+
+def test_resample_mono_int16():
+    data = (np.sin(np.arange(4800) / 10) * 10000).astype('int16')
+    res = resample(data, 48000, 44100)
+    assert res.dtype == np.int16
+    assert res.shape == (4410,)
+
+
+def test_resample_stereo_int16():
+    data = (np.sin(np.arange(9600) / 10) * 10000).astype('int16').reshape(4800, 2)
+    res = resample(data, 48000, 44100)
+    assert res.dtype == np.int16
+    assert res.shape == (4410, 2)
+
+
+def test_resample_same_rate():
+    data = np.arange(10, dtype='int16')
+    assert resample(data, 44100, 44100) is data
+
+
+def test_length_uses_header_rate(tmp_path):
+    write_wav(tmp_path, '0.wav', 44100, 1.)
+    write_wav(tmp_path, '1.wav', 48000, 2.)
+    rw = AudioReadWriter(str(tmp_path), 44100)
+    assert rw.length(0) == pytest.approx(1.)
+    assert rw.length(1) == pytest.approx(2.)
+    assert rw.rate(1) == 48000
+    assert rw.sum_length == pytest.approx(3.)
+    assert rw.mismatched() == [1]
+
+
+def test_normalize_rate(tmp_path):
+    write_wav(tmp_path, '0.wav', 44100, 1.)
+    write_wav(tmp_path, '1.wav', 48000, 2.)
+    write_wav(tmp_path, '2.wav', 22050, .5)
+    before = os.path.getmtime(os.path.join(str(tmp_path), '0.wav'))
+    rw = AudioReadWriter(str(tmp_path), 44100)
+    result = sorted(rw.normalize_rate(workers=2))
+    assert result == [(1, None), (2, None)]
+    assert os.path.getmtime(os.path.join(str(tmp_path), '0.wav')) == before
+    assert rw.mismatched() == []
+    assert rw.rate(1) == rw.rate(2) == 44100
+    assert rw.sum_length == pytest.approx(3.5)
+    assert sorted(os.listdir(str(tmp_path))) == ['0.wav', '1.wav', '2.wav']
+    sr, data = wavfile.read(os.path.join(str(tmp_path), '1.wav'))
+    assert sr == 44100
+    assert data.shape == (88200,)
+    assert data.dtype == np.int16
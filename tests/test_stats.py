@@ -0,0 +1,225 @@
+# encoding: utf-8
+import json
+import os
+
+import pytest
+
+from soyla import stats
+from soyla.stats import EventLog, SessionStats
+
+
+class Clock(object):
+    """
+    Fake clock advanced by the test
+    """
+    def __init__(self):
+        self.t = 1000.
+
+    def __call__(self):
+        return self.t
+
+    def advance(self, dt):
+        self.t += dt
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    return os.path.join(str(tmp_path), 'events.log')
+
+
+def take(log, clock, i, length, duration=5.):
+    """
+    logs recording of one take
+    """
+    log.log(stats.RECORD_START, i)
+    clock.advance(duration)
+    log.log(stats.RECORD_FINISH, i, length)
+
+
+def test_summary(log_path, clock):
+    log = EventLog(log_path, clock=clock)
+    log.log(stats.SESSION)
+    clock.advance(10)
+    take(log, clock, 0, 2.)
+    clock.advance(10)
+    take(log, clock, 0, 3.)
+    clock.advance(10)
+    take(log, clock, 1, 4.)
+    clock.advance(5)
+    log.log(stats.RECORD_START, 2)
+    clock.advance(5)
+    log.log(stats.RECORD_CANCEL, 2)
+    log.close()
+
+    st = SessionStats(log_path)
+    st.update()
+    s = st.summary(remaining=4)
+    assert s['wall_time'] == pytest.approx(55.)
+    assert s['idle_time'] == 0.
+    assert s['recorded_lines'] == 2
+    assert s['takes'] == 3
+    assert s['takes_per_line'] == pytest.approx(1.5)
+    assert s['re_record_rate'] == pytest.approx(1 / 3)
+    assert s['cancels'] == 1
+    assert s['audio_per_hour'] == pytest.approx(7. / 55 * 3600)
+    assert s['projected_time'] == pytest.approx(110.)
+
+
+def test_update_resumes_from_offset(log_path, clock):
+    log = EventLog(log_path, clock=clock)
+    log.log(stats.SESSION)
+    take(log, clock, 0, 2.)
+    log.flush()
+    st = SessionStats(log_path)
+    st.update()
+    offset = st.offset
+    assert offset == os.path.getsize(log_path)
+
+    clock.advance(10)
+    take(log, clock, 1, 3.)
+    log.close()
+    st.update()
+    assert st.offset > offset
+
+    cached = SessionStats(log_path)
+    assert cached.offset == st.offset
+    cached.update()
+    os.remove(log_path + '.stats')
+    rebuilt = SessionStats(log_path)
+    rebuilt.update()
+    assert cached.summary(3) == st.summary(3) == rebuilt.summary(3)
+    assert rebuilt.summary(3)['takes'] == 2
+
+
+def test_idle_time(log_path, clock):
+    log = EventLog(log_path, clock=clock)
+    log.log(stats.SESSION)
+    clock.advance(100)
+    # long take is never idle
+    take(log, clock, 0, 90., duration=95.)
+    clock.advance(1)
+    log.log(stats.PLAY, 0, 90.)
+    clock.advance(120)
+    log.log(stats.NAVIGATE, 1)
+    log.close()
+
+    st = SessionStats(log_path, idle_threshold=60.)
+    st.update()
+    s = st.summary()
+    assert s['idle_time'] == pytest.approx(100.)
+    # take, playback and 30 seconds after it
+    assert s['active_time'] == pytest.approx(95. + 1. + 120.)
+
+
+def test_time_between_sessions_not_counted(log_path, clock):
+    log = EventLog(log_path, clock=clock)
+    log.log(stats.SESSION)
+    log.log(stats.RECORD_START, 0)
+    log.close()
+    clock.advance(3600)
+    log = EventLog(log_path, clock=clock)
+    log.log(stats.SESSION)
+    clock.advance(5)
+    log.log(stats.NAVIGATE, 1)
+    log.close()
+
+    st = SessionStats(log_path)
+    st.update()
+    assert st.summary()['wall_time'] == pytest.approx(5.)
+
+
+def test_truncated_log_resets(log_path, clock):
+    log = EventLog(log_path, clock=clock)
+    take(log, clock, 0, 2.)
+    take(log, clock, 1, 2.)
+    log.close()
+    st = SessionStats(log_path)
+    st.update()
+    assert st.summary()['takes'] == 2
+
+    os.remove(log_path)
+    log = EventLog(log_path, clock=clock)
+    take(log, clock, 5, 2.)
+    log.close()
+    st = SessionStats(log_path)
+    st.update()
+    assert st.summary()['takes'] == 1
+    assert st.lengths == {5: 2.}
+
+
+def test_cache_invalidated(log_path, clock):
+    log = EventLog(log_path, clock=clock)
+    take(log, clock, 0, 2.)
+    log.close()
+    SessionStats(log_path, idle_threshold=60.).update()
+
+    assert SessionStats(log_path, idle_threshold=60.).offset > 0
+    assert SessionStats(log_path, idle_threshold=10.).offset == 0
+
+    with open(log_path + '.stats', 'r') as f:
+        c = json.load(f)
+    c['version'] = stats.CACHE_VERSION - 1
+    with open(log_path + '.stats', 'w') as f:
+        json.dump(c, f)
+    assert SessionStats(log_path, idle_threshold=60.).offset == 0
+
+
+@pytest.mark.parametrize('content', [
+    '{"version": 2, "offs',
+    '{"version": 2}',
+    '[]',
+    '',
+])
+def test_corrupt_cache_rebuilt(log_path, clock, content):
+    log = EventLog(log_path, clock=clock)
+    take(log, clock, 0, 2.)
+    log.close()
+    with open(log_path + '.stats', 'w') as f:
+        f.write(content)
+
+    st = SessionStats(log_path)
+    assert st.offset == 0
+    st.update()
+    assert st.summary()['takes'] == 1
+    assert SessionStats(log_path).offset == os.path.getsize(log_path)
+
+
+def test_malformed_lines_skipped(log_path, clock):
+    log = EventLog(log_path, clock=clock)
+    take(log, clock, 0, 2.)
+    log.close()
+    # session killed mid-write, next one appended on the same line
+    with open(log_path, 'a') as f:
+        f.write('1010.000\trecord_fin')
+        f.write('1011.000\tsession\t-1\t0.000\n')
+        f.write('garbage\tline\tx\ty\n')
+        f.write('\xff\n')
+
+    st = SessionStats(log_path)
+    st.update()
+    assert st.offset == os.path.getsize(log_path)
+    assert st.summary()['takes'] == 1
+
+    log = EventLog(log_path, clock=clock)
+    take(log, clock, 1, 2.)
+    log.close()
+    st.update()
+    assert st.summary()['takes'] == 2
+
+
+def test_log_starts_new_line_after_partial_write(log_path, clock):
+    with open(log_path, 'w') as f:
+        f.write('1000.000\trecord_st')
+    log = EventLog(log_path, clock=clock)
+    take(log, clock, 0, 2.)
+    log.close()
+
+    st = SessionStats(log_path)
+    st.update()
+    assert st.summary()['takes'] == 1
+    assert st.takes == {0: 1}